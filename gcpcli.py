@@ -24,7 +24,8 @@ def main():
     # Check if the Python file exists in the gcptoolkit directory
     script_path = gcptoolkit_dir / f"{script_name}.py"
 
-    if not script_path.exists():
+    # Underscore-prefixed modules are shared helpers, not runnable scripts
+    if script_name.startswith("_") or not script_path.exists():
         print(f"Error: Python script not found: {script_name}.py in {gcptoolkit_dir}")
         print("Available scripts:")
         list_available_scripts(gcptoolkit_dir)
@@ -46,7 +47,7 @@ def list_available_scripts(gcptoolkit_dir):
         print(f"  No gcptoolkit directory found at {gcptoolkit_dir}")
         return
 
-    python_files = list(gcptoolkit_dir.glob("*.py"))
+    python_files = [py_file for py_file in gcptoolkit_dir.glob("*.py") if not py_file.name.startswith("_")]
     if python_files:
         for py_file in sorted(python_files):
             script_name = py_file.stem
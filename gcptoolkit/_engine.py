@@ -0,0 +1,234 @@
+import atexit
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+from google.api_core import exceptions
+from google.auth import exceptions as auth_exceptions
+
+# Errors signalling that we are sending requests too fast
+THROTTLE_ERRORS = (exceptions.TooManyRequests, exceptions.ResourceExhausted)
+
+# Transient errors worth retrying with backoff
+RETRYABLE_ERRORS = THROTTLE_ERRORS + (
+    exceptions.InternalServerError,
+    exceptions.BadGateway,
+    exceptions.ServiceUnavailable,
+    exceptions.GatewayTimeout,
+    exceptions.DeadlineExceeded,
+    exceptions.Aborted,
+    ConnectionError,
+    # Transport errors raised by the HTTP-based BigQuery and Cloud Storage clients
+    requests.exceptions.ConnectionError,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.Timeout,
+    auth_exceptions.TransportError,
+)
+
+# BigQuery reports rate limits and backend hiccups as 403/400 errors with these reasons
+THROTTLE_REASONS = {"rateLimitExceeded"}
+RETRYABLE_REASONS = THROTTLE_REASONS | {"backendError", "internalError"}
+
+
+def error_reasons(error):
+    """Return the `reason` fields of the error details attached to an API error."""
+    return {detail.get("reason") for detail in getattr(error, "errors", None) or [] if isinstance(detail, dict)}
+
+
+def is_throttle(error):
+    return isinstance(error, THROTTLE_ERRORS) or bool(error_reasons(error) & THROTTLE_REASONS)
+
+
+def is_retryable(error):
+    return isinstance(error, RETRYABLE_ERRORS) or bool(error_reasons(error) & RETRYABLE_REASONS)
+
+
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate` acquisitions per second with bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        if tokens > self.capacity:
+            raise ValueError(f"Cannot acquire {tokens} tokens from a bucket holding at most {self.capacity}")
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveConcurrency:
+    """AIMD limit on in-flight calls: grows by one per limit's worth of successes, halves on throttling."""
+
+    def __init__(self, initial, maximum, minimum=1):
+        self.limit = float(initial)
+        self.maximum = maximum
+        self.minimum = minimum
+        self.in_flight = 0
+        self.decreased_at = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """Wait for a free slot and return the time the call started."""
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+            return time.monotonic()
+
+    def release(self, started_at, throttled=False, failed=False):
+        """Free a slot, halving the limit on throttling and growing it only on success."""
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                # Calls started before the last decrease saw the old limit, only back off once for them
+                if started_at >= self.decreased_at:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self.decreased_at = time.monotonic()
+            elif not failed:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+
+class Engine:
+    """Runs API calls for one service with rate limiting, retries and adaptive concurrency.
+
+    Concurrency starts at `initial_workers` in-flight calls and adapts between 1 and `max_workers`.
+    """
+
+    def __init__(self, name, qps=None, max_retries=5, deadline=120.0, max_workers=16, initial_workers=4,
+                 initial_backoff=0.5, max_backoff=32.0):
+        self.name = name
+        self.max_retries = max_retries
+        self.deadline = deadline
+        self.max_workers = max_workers
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.bucket = TokenBucket(qps) if qps else None
+        self.concurrency = AdaptiveConcurrency(initial=min(initial_workers, max_workers), maximum=max_workers)
+        self.counters = {"calls": 0, "retries": 0, "throttles": 0, "failures": 0}
+        self.started_at = None
+        self.lock = threading.Lock()
+
+    def count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def call(self, fn, *args, **kwargs):
+        """Call `fn`, retrying retryable errors with exponential backoff and full jitter."""
+        with self.lock:
+            if self.started_at is None:
+                self.started_at = time.monotonic()
+        call_started_at = time.monotonic()
+        attempt = 0
+
+        while True:
+            if self.bucket:
+                self.bucket.acquire()
+            started_at = self.concurrency.acquire()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                throttled = is_throttle(e)
+                self.concurrency.release(started_at, throttled=throttled, failed=True)
+                if throttled:
+                    self.count("throttles")
+
+                delay = random.uniform(0, min(self.max_backoff, self.initial_backoff * 2 ** attempt))
+                elapsed = time.monotonic() - call_started_at
+                if not is_retryable(e) or attempt >= self.max_retries or elapsed + delay > self.deadline:
+                    self.count("failures")
+                    raise
+
+                self.count("retries")
+                attempt += 1
+                time.sleep(delay)
+                continue
+
+            self.concurrency.release(started_at)
+            self.count("calls")
+            return result
+
+    def call_api(self, method, *args, **kwargs):
+        """Call a Google client method through `call` with the library's own retries turned off.
+
+        Client methods retry throttling and 5xx errors internally for minutes by default,
+        hiding them from this engine and multiplying with its retries. Every attempt gets
+        `retry=None` and the remaining deadline as `timeout`, so this engine is the only
+        retry layer and sees every throttle.
+        """
+        started_at = time.monotonic()
+
+        def attempt():
+            remaining = max(1.0, self.deadline - (time.monotonic() - started_at))
+            return method(*args, retry=None, timeout=remaining, **kwargs)
+
+        return self.call(attempt)
+
+    def map(self, method, items):
+        """Call `method` on every item in parallel with `call_api`, yielding (item, result, error) as calls complete."""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.call_api, method, item): item for item in items}
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result(), None
+                except Exception as e:
+                    yield futures[future], None, e
+
+    def stats(self):
+        """Return the counters along with the effective QPS and current concurrency limit."""
+        with self.lock:
+            stats = dict(self.counters)
+            elapsed = time.monotonic() - self.started_at if self.started_at else 0
+        stats["effective_qps"] = stats["calls"] / elapsed if elapsed else 0.0
+        stats["concurrency_limit"] = int(self.concurrency.limit)
+        return stats
+
+    def report(self):
+        stats = self.stats()
+        print(f"\n[{self.name}] {stats['calls']} call(s), {stats['retries']} retry(ies), "
+              f"{stats['throttles']} throttle(s), {stats['failures']} failure(s), "
+              f"{stats['effective_qps']:.1f} effective QPS, concurrency limit {stats['concurrency_limit']}")
+
+
+def add_engine_arguments(parser):
+    """Add the shared retry, rate-limit and concurrency options to a module's argument parser."""
+    parser.add_argument('--max-qps', type=float, help='Maximum API calls per second (default: unlimited)')
+    parser.add_argument('--max-retries', type=int, default=5, help='Retries for throttled or transient API errors (default: 5)')
+    parser.add_argument('--deadline', type=float, default=120.0, help='Seconds to keep retrying a single API call (default: 120)')
+    parser.add_argument('--max-workers', type=int, default=16, help='Upper bound for parallel API calls, concurrency starts at 4 and adapts up to this value (default: 16)')
+    parser.add_argument('--stats', action='store_true', help='Print API call counters (retries, throttles, effective QPS) when done')
+
+
+def engine_from_args(name, args):
+    """Create the engine for a module from its parsed options, reporting stats on exit if requested."""
+    if args.max_qps is not None and args.max_qps <= 0:
+        print("Error: Max QPS must be a positive number.")
+        exit(1)
+    if args.max_workers <= 0:
+        print("Error: Max workers must be a positive number.")
+        exit(1)
+    if args.max_retries < 0:
+        print("Error: Max retries must not be negative.")
+        exit(1)
+    if args.deadline <= 0:
+        print("Error: Deadline must be a positive number.")
+        exit(1)
+
+    engine = Engine(name, qps=args.max_qps, max_retries=args.max_retries, deadline=args.deadline, max_workers=args.max_workers)
+    if args.stats:
+        # Runs on every exit path, including exit(1) after a failure
+        atexit.register(engine.report)
+    return engine
@@ -0,0 +1,314 @@
+import os
+import json
+import time
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from dotenv import load_dotenv
+import argparse
+from tabulate import tabulate
+
+# Unlike the other toolkit modules the environment is not cleared here:
+# docker and gcloud need PATH, HOME and their credential helpers.
+load_dotenv()
+
+# Set up argument parser
+parser = argparse.ArgumentParser(description='Argument parser for artifacts.')
+parser.add_argument('--push-manifest', type=str, metavar='MANIFEST_FILE', help='Tag and push all images listed in a JSON manifest of local to remote image mappings')
+parser.add_argument('--list-docker-images', action='store_true', help='List Docker images in a repository (use with --repository and --location)')
+parser.add_argument('--list-repositories', action='store_true', help='List repositories in the project (optional: filter with --location)')
+parser.add_argument('--repository', type=str, help='Repository name (overrides the manifest value)')
+parser.add_argument('--location', type=str, help='Repository location, e.g. us-central1 (overrides the manifest value)')
+parser.add_argument('--registry', type=str, help='Registry host to push to instead of <location>-docker.pkg.dev (e.g. localhost:5000)')
+parser.add_argument('--max-workers', type=int, default=4, help='Number of images tagged and pushed in parallel (use with --push-manifest, default: 4)')
+parser.add_argument('--force-push', action='store_true', help='Push even when the registry already holds the same image (use with --push-manifest)')
+parser.add_argument('--cache-ttl', type=int, default=300, help='Seconds a cached listing stays valid (default: 300)')
+parser.add_argument('--refresh', action='store_true', help='Ignore cached listings and fetch them again')
+
+project_id = os.getenv("GCP_PROJECT_ID")
+cache_dir = Path(os.getenv("GCP_TOOLKIT_CACHE_DIR", Path.home() / ".cache" / "gcp-cli-toolkit")) / "artifacts"
+
+
+def run(cmd):
+    """Run a command and return its stdout, raising RuntimeError with stderr on failure."""
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip() or f"{' '.join(cmd)} exited with code {result.returncode}")
+    return result.stdout
+
+
+def read_cache(key, ttl):
+    """Return the cached data for `key` if it is younger than `ttl` seconds, otherwise None."""
+    cache_file = cache_dir / f"{key}.json"
+    try:
+        entry = json.loads(cache_file.read_text())
+        if time.time() - entry["created_at"] > ttl:
+            return None
+        return entry["data"]
+    except (OSError, json.JSONDecodeError, KeyError, TypeError):
+        # Missing or corrupt cache files are treated as a miss
+        return None
+
+
+def write_cache(key, data):
+    """Write the cache entry atomically so concurrent runs never read a half-written file."""
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile("w", dir=cache_dir, suffix=".tmp", delete=False) as f:
+        json.dump({"created_at": time.time(), "data": data}, f)
+    os.replace(f.name, cache_dir / f"{key}.json")
+
+
+def invalidate_cache(key):
+    cache_file = cache_dir / f"{key}.json"
+    if cache_file.exists():
+        cache_file.unlink()
+
+
+def images_cache_key(location, repository):
+    return f"images-{project_id}-{location}-{repository}"
+
+
+def image_repository(image):
+    """Return the image name without its tag or digest, e.g. localhost:5000/p/r/app for localhost:5000/p/r/app:v1."""
+    image = image.partition("@")[0]
+    name, _, tag = image.rpartition(":")
+    return name if name and "/" not in tag else image
+
+
+def local_image_digests(image, remote_image):
+    """Return the digests identifying a local image in the registry of `remote_image`.
+
+    With the classic image store the ID is the config digest, with the containerd
+    image store it is the manifest (or index) digest. RepoDigests add the manifest
+    digests recorded by earlier pushes and pulls of the remote repository.
+    """
+    inspect = json.loads(run(["docker", "image", "inspect", "--format", "{{json .}}", image]))
+    digests = {inspect["Id"]}
+    repository = image_repository(remote_image)
+    for repo_digest in inspect.get("RepoDigests") or []:
+        name, _, digest = repo_digest.partition("@")
+        if name == repository:
+            digests.add(digest)
+    return digests
+
+
+def remote_image_digests(image):
+    """Return the manifest digest and, for single-platform images, the config digest of a remote image.
+
+    Returns an empty set if the tag is not in the registry.
+    """
+    result = subprocess.run(["docker", "buildx", "imagetools", "inspect", "--raw", image], capture_output=True, text=True)
+    if result.returncode != 0:
+        return set()
+    digests = set()
+    manifest = json.loads(result.stdout)
+    if "config" in manifest:
+        digests.add(manifest["config"]["digest"])
+
+    result = subprocess.run(["docker", "buildx", "imagetools", "inspect", "--format", "{{json .Manifest}}", image], capture_output=True, text=True)
+    if result.returncode == 0:
+        digests.add(json.loads(result.stdout)["digest"])
+    return digests
+
+
+def tag_and_push(local_image, remote_image, force_push):
+    """Tag a local image with its remote name and push it unless the registry already holds it."""
+    local_digests = local_image_digests(local_image, remote_image)
+    run(["docker", "tag", local_image, remote_image])
+
+    if not force_push and local_digests & remote_image_digests(remote_image):
+        return "skipped"
+
+    run(["docker", "push", remote_image])
+    return "pushed"
+
+
+def load_manifest(manifest_file):
+    """Load a push manifest, exiting with an error if it or any of its images is invalid."""
+    if not os.path.exists(manifest_file):
+        print(f"Error: Manifest file not found: {manifest_file}")
+        exit(1)
+
+    try:
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+    except json.JSONDecodeError as e:
+        print(f"Error: Manifest file is not valid JSON: {e}")
+        exit(1)
+
+    if not isinstance(manifest, dict) or not isinstance(manifest.get("images", []), list):
+        print("Error: Manifest must be an object with an \"images\" list.")
+        exit(1)
+
+    # Validate every entry up front so a bad manifest fails before anything is pushed
+    for i, image in enumerate(manifest.get("images", [])):
+        if not isinstance(image, dict) or not all(isinstance(image.get(key), str) and image.get(key) for key in ("local", "remote")):
+            print(f"Error: Manifest image #{i + 1} must have non-empty \"local\" and \"remote\" names.")
+            exit(1)
+
+    return manifest
+
+
+def push_manifest(args):
+    if args.max_workers <= 0:
+        print("Error: Max workers must be a positive number.")
+        exit(1)
+
+    manifest = load_manifest(args.push_manifest)
+    repository = args.repository or manifest.get("repository")
+    location = args.location or manifest.get("location")
+    images = manifest.get("images", [])
+
+    if not repository:
+        print("Error: Repository is required (set it in the manifest or use --repository).")
+        exit(1)
+    if not location and not args.registry:
+        print("Error: Location is required (set it in the manifest or use --location).")
+        exit(1)
+    if not project_id:
+        print("Error: GCP_PROJECT_ID not set. Please set it in the .env file.")
+        exit(1)
+    if not images:
+        print("No images found in the manifest.")
+        exit(0)
+
+    registry_url = args.registry or f"{location}-docker.pkg.dev"
+    repository_path = f"{registry_url}/{project_id}/{repository}"
+
+    print(f"Pushing {len(images)} image(s) to {repository_path} with {args.max_workers} worker(s)...")
+    if args.force_push:
+        print("Force push enabled - images already in the registry will be pushed again")
+
+    start_time = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.max_workers) as executor:
+        futures = []
+        for image in images:
+            remote_image = f"{repository_path}/{image['remote']}"
+            futures.append((image["local"], remote_image, executor.submit(tag_and_push, image["local"], remote_image, args.force_push)))
+
+        table_data = []
+        failed = 0
+        for local_image, remote_image, future in futures:
+            try:
+                status = future.result()
+            except Exception as e:
+                status = f"failed: {e}"
+                failed += 1
+            table_data.append([local_image, remote_image, status])
+            print(f"  {local_image} -> {remote_image}: {status}")
+    elapsed = time.monotonic() - start_time
+
+    if location and not args.registry:
+        invalidate_cache(images_cache_key(location, repository))
+
+    headers = ["Local Image", "Remote Image", "Status"]
+    print(tabulate(table_data, headers=headers, tablefmt="pretty", colalign=("left", "left", "left")))
+
+    pushed = sum(1 for row in table_data if row[2] == "pushed")
+    skipped = sum(1 for row in table_data if row[2] == "skipped")
+    print(f"Pushed {pushed}, skipped {skipped} already in registry, failed {failed} in {elapsed:.1f} seconds")
+    if failed:
+        exit(1)
+
+
+def list_docker_images(args):
+    repository = args.repository
+    location = args.location
+
+    if not repository or not location:
+        print("Error: --repository and --location are required.")
+        exit(1)
+    if not project_id:
+        print("Error: GCP_PROJECT_ID not set. Please set it in the .env file.")
+        exit(1)
+
+    repository_path = f"{location}-docker.pkg.dev/{project_id}/{repository}"
+    cache_key = images_cache_key(location, repository)
+
+    print(f"Listing Docker images in repository: {repository_path}")
+
+    images = None if args.refresh else read_cache(cache_key, args.cache_ttl)
+    if images is None:
+        images = json.loads(run([
+            "gcloud", "artifacts", "docker", "images", "list", repository_path,
+            "--include-tags", "--format=json", f"--project={project_id}",
+        ]))
+        write_cache(cache_key, images)
+    else:
+        print(f"Using cached listing (younger than {args.cache_ttl} seconds, use --refresh to fetch again)")
+
+    if images:
+        print(f"Found {len(images)} image(s):")
+
+        table_data = []
+        for image in images:
+            tags = image.get("tags") or []
+            if isinstance(tags, list):
+                tags = ", ".join(tags)
+            table_data.append([
+                image["package"].rsplit("/", 1)[-1],
+                image["version"],
+                tags or "N/A",
+                image.get("updateTime", "N/A"),
+            ])
+
+        headers = ["Image", "Digest", "Tags", "Updated"]
+        print(tabulate(table_data, headers=headers, tablefmt="pretty", colalign=("left", "left", "left", "left")))
+    else:
+        print("No images found in the repository.")
+
+
+def list_repositories(args):
+    location = args.location
+
+    if not project_id:
+        print("Error: GCP_PROJECT_ID not set. Please set it in the .env file.")
+        exit(1)
+
+    cache_key = f"repositories-{project_id}-{location or 'all'}"
+
+    print(f"Listing repositories in project: {project_id}")
+    if location:
+        print(f"Filtering by location: {location}")
+
+    repositories = None if args.refresh else read_cache(cache_key, args.cache_ttl)
+    if repositories is None:
+        cmd = ["gcloud", "artifacts", "repositories", "list", "--format=json", f"--project={project_id}"]
+        if location:
+            cmd.append(f"--location={location}")
+        repositories = json.loads(run(cmd))
+        write_cache(cache_key, repositories)
+    else:
+        print(f"Using cached listing (younger than {args.cache_ttl} seconds, use --refresh to fetch again)")
+
+    if repositories:
+        print(f"Found {len(repositories)} repository(s):")
+
+        table_data = []
+        for repository in repositories:
+            # name has the form projects/<project>/locations/<location>/repositories/<repository>
+            parts = repository["name"].split("/")
+            table_data.append([parts[-1], parts[3], repository.get("format", "N/A")])
+
+        headers = ["Repository", "Location", "Format"]
+        print(tabulate(table_data, headers=headers, tablefmt="pretty", colalign=("left", "left", "left")))
+    else:
+        print("No repositories found in the project.")
+
+
+def main():
+    args = parser.parse_args()
+
+    if args.push_manifest:
+        push_manifest(args)
+    elif args.list_docker_images:
+        list_docker_images(args)
+    elif args.list_repositories:
+        list_repositories(args)
+    else:
+        print(parser.format_help())
+
+
+if __name__ == "__main__":
+    main()
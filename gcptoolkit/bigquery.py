@@ -1,8 +1,11 @@
 import os
+import uuid
+from google.api_core import exceptions
 from google.cloud import bigquery
 from dotenv import load_dotenv
 import argparse
 import json
+from _engine import add_engine_arguments, engine_from_args
 
 os.environ.clear()
 load_dotenv()
@@ -29,6 +32,48 @@ def create_schema_field(field_data):
             mode=field_data.get('mode', 'NULLABLE')
         )
 
+def run_job(engine, bigquery_client, submit, location):
+    """Submit a job under a fixed job ID and wait for it, never running it twice.
+
+    `submit` receives the job ID, the location and a request timeout, and must
+    not retry on its own. If a retried submission finds the job already exists
+    (the first response was lost), it reattaches to that job, which can only be
+    looked up in the location it runs in. After submission only polling is retried.
+    """
+    job_id = f"gcptoolkit_{uuid.uuid4().hex}"
+
+    def submit_once(retry, timeout):
+        try:
+            return submit(job_id, location, timeout)
+        except exceptions.Conflict:
+            return bigquery_client.get_job(job_id, location=location, retry=retry, timeout=timeout)
+
+    job = engine.call_api(submit_once)
+
+    def poll(retry, timeout):
+        # The timeout bounds single requests, not how long a large job may run
+        try:
+            return job.result(retry=retry)
+        except Exception as e:
+            if job.state == "DONE":
+                # The job itself failed, polling again would only return the same error
+                raise RuntimeError(f"Job {job_id} failed: {e}") from e
+            raise
+
+    return engine.call_api(poll)
+
+def run_query(engine, bigquery_client, query):
+    """Run a query with run_job, using a free dry run to find the location it runs in."""
+    dry_run_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+    dry_run = engine.call_api(bigquery_client.query, query, job_config=dry_run_config, job_retry=None)
+
+    def submit_query(job_id, location, timeout):
+        return bigquery_client.query(
+            query, job_id=job_id, location=location, retry=None, job_retry=None, timeout=timeout
+        )
+
+    return run_job(engine, bigquery_client, submit_query, dry_run.location)
+
 # Set up argument parser
 parser = argparse.ArgumentParser(description='Argument parser for big query.')
 parser.add_argument('--create-dataset', type=str, help='Name of the dataset to create')
@@ -43,12 +88,15 @@ parser.add_argument('--query-file', type=str, help='Execute SQL query from file'
 # optional arguments
 parser.add_argument('--json-schema', type=str, help='JSON schema string for the table')
 parser.add_argument('--force', action='store_true', help='Force the operation to run without confirmation')
+add_engine_arguments(parser)
 
 project_id = os.getenv("GCP_PROJECT_ID")
 service_account_file = os.getenv("GCP_SERVICE_ACCOUNT_PATH")
 
 args = parser.parse_args()
 
+engine = engine_from_args("bigquery", args)
+
 # check for arg json_schema
 json_schema = args.json_schema
 
@@ -62,7 +110,7 @@ if args.create_dataset:
 
     dataset_id = f"{project_id}.{dataset_name}"
     dataset = bigquery.Dataset(dataset_id)
-    bigquery_client.create_dataset(dataset)
+    engine.call_api(bigquery_client.create_dataset, dataset)
 
     print(f"Dataset {dataset_name} created")
 
@@ -77,9 +125,9 @@ elif args.delete_dataset:
     dataset_id = f"{project_id}.{dataset_name}"
 
     if args.force:
-        bigquery_client.delete_dataset(dataset_id, delete_contents=True)
+        engine.call_api(bigquery_client.delete_dataset, dataset_id, delete_contents=True)
     else:
-        bigquery_client.delete_dataset(dataset_id)
+        engine.call_api(bigquery_client.delete_dataset, dataset_id)
 
     print(f"Dataset {dataset_name} deleted")
 
@@ -92,7 +140,7 @@ elif args.delete_table:
     bigquery_client = bigquery.Client.from_service_account_json(service_account_file)
 
     table_id = f"{project_id}.{dataset_name}.{table_name}"
-    bigquery_client.delete_table(table_id)
+    engine.call_api(bigquery_client.delete_table, table_id)
 
     print(f"Table {table_name} deleted from dataset {dataset_name}")
 
@@ -129,7 +177,7 @@ elif args.create_table:
     else:
         table = bigquery.Table(table_id)
 
-    table = bigquery_client.create_table(table)
+    table = engine.call_api(bigquery_client.create_table, table)
 
     print(f"Table {table_name} created in dataset {dataset_name}")
 
@@ -171,7 +219,7 @@ elif args.update_table:
     fields = [field.name for field in schema_fields]
 
     # update the table
-    bigquery_client.update_table(table, ["schema"])
+    engine.call_api(bigquery_client.update_table, table, ["schema"])
 
     print(f"Table {table_name} updated in dataset {dataset_name}")
 
@@ -189,10 +237,18 @@ elif args.load_csv:
         source_format=bigquery.SourceFormat.CSV,
     )
 
-    with open(csv_file_path, 'rb') as source_file:
-        job = bigquery_client.load_table_from_file(source_file, table_id, job_config=job_config)
+    # Load jobs run where the dataset lives
+    dataset = engine.call_api(bigquery_client.get_dataset, f"{project_id}.{dataset_name}")
+
+    def submit_load(job_id, location, timeout):
+        # Reopen the file on every attempt, a failed upload leaves it partially consumed
+        with open(csv_file_path, 'rb') as source_file:
+            return bigquery_client.load_table_from_file(
+                source_file, table_id, job_id=job_id, location=location, job_config=job_config,
+                num_retries=0, timeout=timeout,
+            )
 
-    job.result()
+    run_job(engine, bigquery_client, submit_load, dataset.location)
 
     print(f"CSV file {csv_file_path} loaded into table {table_name} in dataset {dataset_name}")
 
@@ -205,8 +261,7 @@ elif args.query:
     bigquery_client = bigquery.Client.from_service_account_json(service_account_file)
 
     try:
-        query_job = bigquery_client.query(query)
-        results = query_job.result()
+        results = run_query(engine, bigquery_client, query)
 
         print(f"Query executed successfully!")
         print(f"Results:")
@@ -240,8 +295,7 @@ elif args.query_file:
 
     # Execute the query
     try:
-        query_job = bigquery_client.query(query)
-        results = query_job.result()
+        results = run_query(engine, bigquery_client, query)
 
         print(f"Query executed successfully!")
         print(f"Results:")
@@ -3,6 +3,7 @@ from google.cloud import storage
 from dotenv import load_dotenv
 import argparse
 from tabulate import tabulate
+from _engine import add_engine_arguments, engine_from_args
 
 os.environ.clear()
 load_dotenv()
@@ -17,12 +18,15 @@ parser.add_argument('--download-file', nargs='+', metavar='ARG', help='Download
 parser.add_argument('--delete-file', nargs=2, metavar=('BUCKET_NAME', 'FILE_PATH'), help='Delete a file from a bucket')
 parser.add_argument('--delete-bucket', type=str, help='Name of the bucket to delete')
 parser.add_argument('--force', action='store_true', help='Force delete bucket (delete all objects first)')
+add_engine_arguments(parser)
 
 project_id = os.getenv("GCP_PROJECT_ID")
 service_account_file = os.getenv("GCP_SERVICE_ACCOUNT_PATH")
 
 args = parser.parse_args()
 
+engine = engine_from_args("storage", args)
+
 # check for --region
 region = args.region
 
@@ -38,11 +42,11 @@ if args.create_bucket:
 
     if region:
         # Create bucket with specific region
-        bucket = storage_client.create_bucket(bucket_name, location=region, project=project_id)
+        bucket = engine.call_api(storage_client.create_bucket, bucket_name, location=region, project=project_id)
         print(f"Bucket {bucket.name} created in region {region}")
     else:
         # Create bucket in default location
-        bucket = storage_client.create_bucket(bucket_name, project=project_id)
+        bucket = engine.call_api(storage_client.create_bucket, bucket_name, project=project_id)
         print(f"Bucket {bucket.name} created in default location")
 
 # check for arg list_buckets
@@ -52,7 +56,7 @@ elif args.list_buckets:
     storage_client = storage.Client.from_service_account_json(service_account_file)
 
     # List all buckets in the project
-    buckets = list(storage_client.list_buckets(project=project_id))
+    buckets = engine.call_api(lambda **kwargs: list(storage_client.list_buckets(project=project_id, **kwargs)))
 
     if buckets:
         print(f"Found {len(buckets)} bucket(s):")
@@ -83,7 +87,7 @@ elif args.upload_file:
 
     bucket = storage_client.bucket(bucket_name)
     blob = bucket.blob(file_path)
-    blob.upload_from_filename(file_path)
+    engine.call_api(blob.upload_from_filename, file_path)
 
     print(f"File {file_path} uploaded to bucket {bucket_name}")
 
@@ -110,7 +114,7 @@ elif args.download_file:
 
     bucket = storage_client.bucket(bucket_name)
     blob = bucket.blob(file_path)
-    blob.download_to_filename(destination_path)
+    engine.call_api(blob.download_to_filename, destination_path)
 
     print(f"File downloaded to: {destination_path}")
 
@@ -124,7 +128,7 @@ elif args.delete_file:
 
     bucket = storage_client.bucket(bucket_name)
     blob = bucket.blob(file_path)
-    blob.delete()
+    engine.call_api(blob.delete)
 
     print(f"File {file_path} deleted from bucket {bucket_name}")
 
@@ -143,18 +147,25 @@ elif args.delete_bucket:
 
     if force:
         # Delete all objects in the bucket first
-        blobs = list(bucket.list_blobs())
+        blobs = engine.call_api(lambda **kwargs: list(bucket.list_blobs(**kwargs)))
         if blobs:
             print(f"Found {len(blobs)} object(s) in bucket. Deleting all objects...")
-            for blob in blobs:
-                blob.delete()
-                print(f"Deleted object: {blob.name}")
+            failed = 0
+            for blob, _, error in engine.map(lambda blob, **kwargs: blob.delete(**kwargs), blobs):
+                if error:
+                    print(f"Error deleting object {blob.name}: {error}")
+                    failed += 1
+                else:
+                    print(f"Deleted object: {blob.name}")
+            if failed:
+                print(f"Error: {failed} object(s) could not be deleted, bucket not deleted.")
+                exit(1)
             print("All objects deleted.")
         else:
             print("Bucket is empty.")
 
     # Delete the bucket
-    bucket.delete()
+    engine.call_api(bucket.delete)
 
     print(f"Bucket {bucket_name} deleted")
 
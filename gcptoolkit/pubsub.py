@@ -1,7 +1,14 @@
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from google.api_core import exceptions
 from google.cloud import pubsub_v1
+from google.protobuf import timestamp_pb2
 from dotenv import load_dotenv
 import argparse
+from _engine import TokenBucket, add_engine_arguments, engine_from_args
 
 os.environ.clear()
 load_dotenv()
@@ -15,25 +22,68 @@ parser.add_argument('--publish', nargs=2, metavar=('TOPIC_NAME', 'MESSAGE'), hel
 parser.add_argument('--ordering-key', type=str, help='Ordering key for message ordering (use with --publish)')
 parser.add_argument('--subscribe', nargs=2, metavar=('TOPIC_NAME', 'SUBSCRIPTION_NAME'), help='Create a subscription to a topic')
 parser.add_argument('--ordered', action='store_true', help='Enable message ordering for subscription (use with --subscribe)')
+parser.add_argument('--dead-letter-topic', type=str, help='Topic to forward undeliverable messages to (use with --subscribe)')
+parser.add_argument('--max-delivery-attempts', type=int, default=5, help='Delivery attempts before a message is dead-lettered (use with --dead-letter-topic, 5-100, default: 5)')
 parser.add_argument('--delete-subscription', type=str, help='Name of the subscription to delete')
 parser.add_argument('--receive', nargs='+', metavar=('SUBSCRIPTION_NAME', 'MAX_MESSAGES'), help='Receive pending messages from a subscription (optional: specify max number of messages)')
 parser.add_argument('--listen', nargs='+', metavar=('SUBSCRIPTION_NAME', 'TIMEOUT'), help='Listen for messages from a subscription (optional: specify timeout in seconds, default: 60 seconds)')
+parser.add_argument('--create-snapshot', nargs=2, metavar=('SUBSCRIPTION_NAME', 'SNAPSHOT_NAME'), help='Create a snapshot of the acknowledgment state of a subscription')
+parser.add_argument('--list-snapshots', action='store_true', help='List all snapshots in the project')
+parser.add_argument('--delete-snapshot', type=str, help='Name of the snapshot to delete')
+parser.add_argument('--seek-snapshot', nargs=2, metavar=('SUBSCRIPTION_NAME', 'SNAPSHOT_NAME'), help='Seek a subscription to a snapshot')
+parser.add_argument('--seek-time', nargs=2, metavar=('SUBSCRIPTION_NAME', 'TIMESTAMP'), help='Seek a subscription to an ISO 8601 timestamp (e.g. 2024-01-31T12:00:00Z)')
+parser.add_argument('--replay-dlq', nargs=2, metavar=('DLQ_SUBSCRIPTION_NAME', 'TOPIC_NAME'), help='Drain a dead-letter subscription and republish its messages to a topic')
+parser.add_argument('--batch-size', type=int, default=100, help='Messages pulled and published per batch (use with --replay-dlq, default: 100)')
+parser.add_argument('--rate-limit', type=float, help='Maximum messages republished per second (use with --replay-dlq)')
+parser.add_argument('--filter-attribute', action='append', metavar='KEY=VALUE', help='Only replay messages with this attribute, can be repeated (use with --replay-dlq)')
+add_engine_arguments(parser)
 
 project_id = os.getenv("GCP_PROJECT_ID")
 service_account_file = os.getenv("GCP_SERVICE_ACCOUNT_PATH")
 
+# Attributes added by Pub/Sub when a message is forwarded to a dead-letter topic
+DEAD_LETTER_ATTRIBUTE_PREFIX = "CloudPubSubDeadLetter"
+
+# Unary pull may come back empty while messages remain, so only treat a
+# subscription as drained after this many empty pulls in a row
+EMPTY_PULLS_BEFORE_DRAINED = 3
+
+# Ack deadline (the maximum allowed) used to hold pulled messages while they are
+# republished, and to hold back skipped or failed messages for the rest of a replay
+HELD_ACK_DEADLINE = 600
+
+# Keyword arguments of PublisherClient.publish, attributes with these names cannot be republished
+PUBLISH_KEYWORDS = {"topic", "data", "ordering_key", "retry", "timeout"}
+
+
+def get_publisher(**kwargs):
+    """Create a publisher client, connecting to the emulator when PUBSUB_EMULATOR_HOST is set."""
+    if os.getenv("PUBSUB_EMULATOR_HOST"):
+        return pubsub_v1.PublisherClient(**kwargs)
+    return pubsub_v1.PublisherClient.from_service_account_file(service_account_file, **kwargs)
+
+
+def get_subscriber():
+    """Create a subscriber client, connecting to the emulator when PUBSUB_EMULATOR_HOST is set."""
+    if os.getenv("PUBSUB_EMULATOR_HOST"):
+        return pubsub_v1.SubscriberClient()
+    return pubsub_v1.SubscriberClient.from_service_account_file(service_account_file)
+
+
 args = parser.parse_args()
 
+engine = engine_from_args("pubsub", args)
+
 # check for arg create_topic
 if args.create_topic:
     topic_name = args.create_topic
 
     print(f"Creating topic: {topic_name}")
 
-    publisher = pubsub_v1.PublisherClient.from_service_account_file(service_account_file)
+    publisher = get_publisher()
     topic_path = publisher.topic_path(project_id, topic_name)
 
-    topic = publisher.create_topic(request={"name": topic_path})
+    topic = engine.call_api(publisher.create_topic, request={"name": topic_path})
 
     print(f"Created topic: {topic.name}")
 
@@ -41,16 +91,12 @@ if args.create_topic:
 elif args.list_topics:
     print("Listing all topics...")
 
-    publisher = pubsub_v1.PublisherClient.from_service_account_file(service_account_file)
+    publisher = get_publisher()
     project_path = f"projects/{project_id}"
 
     # List all topics in the project
     request = {"project": project_path}
-    page_result = publisher.list_topics(request=request)
-
-    topics = []
-    for topic in page_result:
-        topics.append(topic.name)
+    topics = engine.call_api(lambda **kwargs: [topic.name for topic in publisher.list_topics(request=request, **kwargs)])
 
     if topics:
         print(f"Found {len(topics)} topic(s):")
@@ -65,10 +111,10 @@ elif args.delete_topic:
 
     print(f"Deleting topic: {topic_name}")
 
-    publisher = pubsub_v1.PublisherClient.from_service_account_file(service_account_file)
+    publisher = get_publisher()
     topic_path = publisher.topic_path(project_id, topic_name)
 
-    publisher.delete_topic(request={"topic": topic_path})
+    engine.call_api(publisher.delete_topic, request={"topic": topic_path})
 
     print(f"Topic {topic_name} deleted")
 
@@ -80,7 +126,7 @@ elif args.publish:
     if args.ordering_key:
         print(f"Using ordering key: {args.ordering_key}")
 
-    publisher = pubsub_v1.PublisherClient.from_service_account_file(service_account_file)
+    publisher = get_publisher()
     topic_path = publisher.topic_path(project_id, topic_name)
 
         # Publish the message with optional ordering key
@@ -89,20 +135,15 @@ elif args.publish:
         publisher_options = pubsub_v1.types.PublisherOptions(
             enable_message_ordering=True
         )
-        publisher = pubsub_v1.PublisherClient.from_service_account_file(
-            service_account_file,
-            publisher_options=publisher_options
-        )
+        publisher = get_publisher(publisher_options=publisher_options)
 
         # Publish with ordering key
-        future = publisher.publish(topic_path, message.encode("utf-8"), ordering_key=args.ordering_key)
-        message_id = future.result()
+        message_id = engine.call_api(lambda **kwargs: publisher.publish(topic_path, message.encode("utf-8"), ordering_key=args.ordering_key, **kwargs).result())
         print(f"Published message with ID: {message_id}")
         print(f"✓ Message published with ordering key: {args.ordering_key}")
     else:
         # Use regular publish for unordered messages
-        future = publisher.publish(topic_path, message.encode("utf-8"))
-        message_id = future.result()
+        message_id = engine.call_api(lambda **kwargs: publisher.publish(topic_path, message.encode("utf-8"), **kwargs).result())
         print(f"Published message with ID: {message_id}")
 
 # check for arg subscribe
@@ -112,8 +153,13 @@ elif args.subscribe:
     print(f"Creating subscription '{subscription_name}' to topic '{topic_name}'")
     if args.ordered:
         print("Message ordering enabled for this subscription")
+    if args.dead_letter_topic:
+        if not 5 <= args.max_delivery_attempts <= 100:
+            print("Error: Max delivery attempts must be between 5 and 100.")
+            exit(1)
+        print(f"Dead-letter topic: {args.dead_letter_topic} (after {args.max_delivery_attempts} delivery attempts)")
 
-    subscriber = pubsub_v1.SubscriberClient.from_service_account_file(service_account_file)
+    subscriber = get_subscriber()
     topic_path = subscriber.topic_path(project_id, topic_name)
     subscription_path = subscriber.subscription_path(project_id, subscription_name)
 
@@ -121,12 +167,20 @@ elif args.subscribe:
     subscription_request = {"name": subscription_path, "topic": topic_path}
     if args.ordered:
         subscription_request["enable_message_ordering"] = True
+    if args.dead_letter_topic:
+        subscription_request["dead_letter_policy"] = {
+            "dead_letter_topic": subscriber.topic_path(project_id, args.dead_letter_topic),
+            "max_delivery_attempts": args.max_delivery_attempts,
+        }
 
-    subscription = subscriber.create_subscription(request=subscription_request)
+    subscription = engine.call_api(subscriber.create_subscription, request=subscription_request)
 
     print(f"Created subscription: {subscription.name}")
     if args.ordered:
         print("✓ Message ordering is enabled for this subscription")
+    if args.dead_letter_topic:
+        print(f"✓ Dead-letter policy is enabled, undeliverable messages go to '{args.dead_letter_topic}'")
+        print("  Note: the Pub/Sub service account needs publisher rights on the dead-letter topic and subscriber rights on this subscription")
 
 # check for arg delete_subscription
 elif args.delete_subscription:
@@ -134,10 +188,10 @@ elif args.delete_subscription:
 
     print(f"Deleting subscription: {subscription_name}")
 
-    subscriber = pubsub_v1.SubscriberClient.from_service_account_file(service_account_file)
+    subscriber = get_subscriber()
     subscription_path = subscriber.subscription_path(project_id, subscription_name)
 
-    subscriber.delete_subscription(request={"subscription": subscription_path})
+    engine.call_api(subscriber.delete_subscription, request={"subscription": subscription_path})
 
     print(f"Subscription {subscription_name} deleted")
 
@@ -164,11 +218,11 @@ elif args.receive:
     else:
         print("Pulling all pending messages (up to 1000)")
 
-    subscriber = pubsub_v1.SubscriberClient.from_service_account_file(service_account_file)
+    subscriber = get_subscriber()
     subscription_path = subscriber.subscription_path(project_id, subscription_name)
 
     # Pull messages based on max_messages parameter
-    response = subscriber.pull(request={"subscription": subscription_path, "max_messages": max_messages})
+    response = engine.call_api(subscriber.pull, request={"subscription": subscription_path, "max_messages": max_messages})
 
     if response.received_messages:
         ack_ids = []
@@ -182,7 +236,7 @@ elif args.receive:
             ack_ids.append(received_message.ack_id)
 
         # Acknowledge all messages
-        subscriber.acknowledge(request={"subscription": subscription_path, "ack_ids": ack_ids})
+        engine.call_api(subscriber.acknowledge, request={"subscription": subscription_path, "ack_ids": ack_ids})
         print(f"\nAll {len(response.received_messages)} message(s) acknowledged.")
     else:
         print("No pending messages available in the subscription.")
@@ -208,7 +262,7 @@ elif args.listen:
         print(f"Listening indefinitely for messages from subscription '{subscription_name}'...")
         print("Press Ctrl+C to stop\n")
 
-    subscriber = pubsub_v1.SubscriberClient.from_service_account_file(service_account_file)
+    subscriber = get_subscriber()
     subscription_path = subscriber.subscription_path(project_id, subscription_name)
 
     def callback(message):
@@ -237,5 +291,288 @@ elif args.listen:
         streaming_pull_future.cancel()
         streaming_pull_future.result()
 
+# check for arg create_snapshot
+elif args.create_snapshot:
+    subscription_name, snapshot_name = args.create_snapshot
+
+    print(f"Creating snapshot '{snapshot_name}' of subscription '{subscription_name}'")
+
+    subscriber = get_subscriber()
+    subscription_path = subscriber.subscription_path(project_id, subscription_name)
+    snapshot_path = subscriber.snapshot_path(project_id, snapshot_name)
+
+    snapshot = engine.call_api(subscriber.create_snapshot, request={"name": snapshot_path, "subscription": subscription_path})
+
+    print(f"Created snapshot: {snapshot.name}")
+    print(f"Snapshot expires at: {snapshot.expire_time}")
+
+# check for arg list_snapshots
+elif args.list_snapshots:
+    print("Listing all snapshots...")
+
+    subscriber = get_subscriber()
+    project_path = f"projects/{project_id}"
+
+    snapshots = engine.call_api(lambda **kwargs: list(subscriber.list_snapshots(request={"project": project_path}, **kwargs)))
+
+    if snapshots:
+        print(f"Found {len(snapshots)} snapshot(s):")
+        for snapshot in snapshots:
+            print(f"  - {snapshot.name} (topic: {snapshot.topic}, expires: {snapshot.expire_time})")
+    else:
+        print("No snapshots found in the project.")
+
+# check for arg delete_snapshot
+elif args.delete_snapshot:
+    snapshot_name = args.delete_snapshot
+
+    print(f"Deleting snapshot: {snapshot_name}")
+
+    subscriber = get_subscriber()
+    snapshot_path = subscriber.snapshot_path(project_id, snapshot_name)
+
+    engine.call_api(subscriber.delete_snapshot, request={"snapshot": snapshot_path})
+
+    print(f"Snapshot {snapshot_name} deleted")
+
+# check for arg seek_snapshot
+elif args.seek_snapshot:
+    subscription_name, snapshot_name = args.seek_snapshot
+
+    print(f"Seeking subscription '{subscription_name}' to snapshot '{snapshot_name}'")
+
+    subscriber = get_subscriber()
+    subscription_path = subscriber.subscription_path(project_id, subscription_name)
+    snapshot_path = subscriber.snapshot_path(project_id, snapshot_name)
+
+    engine.call_api(subscriber.seek, request={"subscription": subscription_path, "snapshot": snapshot_path})
+
+    print(f"✓ Subscription {subscription_name} now reflects the acknowledgment state of snapshot {snapshot_name}")
+
+# check for arg seek_time
+elif args.seek_time:
+    subscription_name, timestamp = args.seek_time
+
+    try:
+        seek_time = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    except ValueError:
+        print("Error: Timestamp must be in ISO 8601 format (e.g. 2024-01-31T12:00:00Z).")
+        exit(1)
+
+    print(f"Seeking subscription '{subscription_name}' to {seek_time.isoformat()}")
+
+    subscriber = get_subscriber()
+    subscription_path = subscriber.subscription_path(project_id, subscription_name)
+
+    seek_timestamp = timestamp_pb2.Timestamp()
+    seek_timestamp.FromDatetime(seek_time)
+
+    engine.call_api(subscriber.seek, request={"subscription": subscription_path, "time": seek_timestamp})
+
+    print(f"✓ Messages published after {seek_time.isoformat()} will be redelivered to {subscription_name}")
+    print("  Note: messages acknowledged before that time are only redelivered if the subscription retains acked messages")
+
+# check for arg replay_dlq
+elif args.replay_dlq:
+    dlq_subscription_name, topic_name = args.replay_dlq
+
+    if args.batch_size <= 0 or args.batch_size > 1000:
+        print("Error: Batch size must be between 1 and 1000.")
+        exit(1)
+    if args.rate_limit is not None and args.rate_limit <= 0:
+        print("Error: Rate limit must be a positive number.")
+        exit(1)
+    if args.deadline > HELD_ACK_DEADLINE:
+        # Retries past the ack deadline would republish messages Pub/Sub already redelivered
+        print(f"Error: Deadline must not exceed {HELD_ACK_DEADLINE} seconds with --replay-dlq.")
+        exit(1)
+
+    attribute_filter = {}
+    for item in args.filter_attribute or []:
+        if "=" not in item:
+            print(f"Error: Invalid filter '{item}', expected KEY=VALUE.")
+            exit(1)
+        key, value = item.split("=", 1)
+        attribute_filter[key] = value
+
+    print(f"Replaying messages from dead-letter subscription '{dlq_subscription_name}' to topic '{topic_name}'")
+    print(f"Using up to {args.max_workers} parallel API call(s) with batches of {args.batch_size} message(s)")
+    if args.rate_limit:
+        print(f"Rate limited to {args.rate_limit} message(s) per second")
+    if attribute_filter:
+        print(f"Only replaying messages with attributes: {attribute_filter}")
+
+    subscriber = get_subscriber()
+    subscription_path = subscriber.subscription_path(project_id, dlq_subscription_name)
+
+    # Let the client group publishes into batches matching the pull size. Ordering is
+    # enabled so messages keep their ordering key, messages without one are unaffected.
+    batch_settings = pubsub_v1.types.BatchSettings(max_messages=args.batch_size)
+    publisher_options = pubsub_v1.types.PublisherOptions(enable_message_ordering=True)
+    publisher = get_publisher(batch_settings=batch_settings, publisher_options=publisher_options)
+    topic_path = publisher.topic_path(project_id, topic_name)
+
+    rate_limiter = TokenBucket(args.rate_limit) if args.rate_limit else None
+
+    # Messages can be delivered more than once, so progress is tracked by message ID
+    replayed_ids = set()
+    failed_ids = set()
+    skipped_ids = set()
+    held_ack_ids = {}  # message ID -> latest ack ID of skipped and failed messages
+    stats_lock = threading.Lock()
+
+    def pull_batch(max_messages, retry, timeout):
+        try:
+            return subscriber.pull(
+                request={"subscription": subscription_path, "max_messages": max_messages},
+                retry=retry,
+                timeout=min(timeout, 10),
+            ).received_messages
+        except exceptions.DeadlineExceeded:
+            # No messages arrived before the timeout, the subscription is drained
+            return []
+
+    def publish_batch(batch, published, paused_keys, retry, timeout):
+        """Publish the messages of a batch whose ack ID is not in `published` yet, raising the first error.
+
+        Runs as a single engine call, so a retry only republishes the messages that failed.
+        A failed publish pauses its ordering key, the key is added to `paused_keys`.
+        """
+        for ordering_key in paused_keys:
+            publisher.resume_publish(topic_path, ordering_key)
+        paused_keys.clear()
+
+        futures = [
+            (ack_id, message, publisher.publish(topic_path, message.data, ordering_key=message.ordering_key, retry=retry, timeout=timeout, **attributes))
+            for ack_id, message, attributes in batch
+            if ack_id not in published
+        ]
+
+        error = None
+        for ack_id, message, future in futures:
+            try:
+                future.result()
+                published.add(ack_id)
+            except Exception as e:
+                if message.ordering_key:
+                    paused_keys.add(message.ordering_key)
+                error = error or e
+        if error:
+            raise error
+
+    def hold(message_ids, message_id, ack_id):
+        """Record a message left in the dead-letter subscription, keeping its latest ack ID to release it later."""
+        with stats_lock:
+            message_ids.add(message_id)
+            held_ack_ids[message_id] = ack_id
+
+    def replay_worker():
+        empty_pulls = 0
+        while empty_pulls < EMPTY_PULLS_BEFORE_DRAINED:
+            pull_size = args.batch_size
+            if rate_limiter:
+                # Take the tokens before pulling so pulled messages never wait for them
+                pull_size = min(args.batch_size, int(rate_limiter.capacity))
+                rate_limiter.acquire(pull_size)
+
+            received_messages = engine.call_api(pull_batch, pull_size)
+            if not received_messages:
+                empty_pulls += 1
+                continue
+
+            # Hold the whole pull right away so its ack IDs stay valid while the engine retries the publish
+            engine.call_api(subscriber.modify_ack_deadline, request={
+                "subscription": subscription_path,
+                "ack_ids": [received_message.ack_id for received_message in received_messages],
+                "ack_deadline_seconds": HELD_ACK_DEADLINE,
+            })
+
+            batch = []
+            new_messages = 0
+            for received_message in received_messages:
+                ack_id, message = received_message.ack_id, received_message.message
+                with stats_lock:
+                    # Redelivery of a message already skipped or failed, keep holding it without trying again
+                    seen = message.message_id in held_ack_ids
+                    if seen:
+                        held_ack_ids[message.message_id] = ack_id
+                if seen:
+                    continue
+
+                new_messages += 1
+                if any(message.attributes.get(key) != value for key, value in attribute_filter.items()):
+                    hold(skipped_ids, message.message_id, ack_id)
+                    continue
+
+                reserved = PUBLISH_KEYWORDS.intersection(message.attributes)
+                if reserved:
+                    print(f"Error: Message {message.message_id} has attribute(s) {', '.join(sorted(reserved))} that cannot be republished.")
+                    hold(failed_ids, message.message_id, ack_id)
+                    continue
+
+                attributes = {
+                    key: value for key, value in message.attributes.items()
+                    if not key.startswith(DEAD_LETTER_ATTRIBUTE_PREFIX)
+                }
+                batch.append((ack_id, message, attributes))
+
+            published = set()
+            paused_keys = set()
+            if batch:
+                try:
+                    engine.call_api(publish_batch, batch, published, paused_keys)
+                except Exception as e:
+                    print(f"Error republishing {len(batch) - len(published)} message(s): {e}")
+                finally:
+                    # Keys paused by the last failed attempt would reject every later publish with that key
+                    for ordering_key in paused_keys:
+                        publisher.resume_publish(topic_path, ordering_key)
+
+            # Only acknowledge messages that were republished successfully, failed ones stay held
+            ack_ids = [ack_id for ack_id, _, _ in batch if ack_id in published]
+            if ack_ids:
+                engine.call_api(subscriber.acknowledge, request={"subscription": subscription_path, "ack_ids": ack_ids})
+
+            for ack_id, message, _ in batch:
+                if ack_id not in published:
+                    hold(failed_ids, message.message_id, ack_id)
+            with stats_lock:
+                replayed_ids.update(message.message_id for ack_id, message, _ in batch if ack_id in published)
+                if batch:
+                    print(f"Replayed {len(replayed_ids)} message(s) so far...")
+
+            # Pulls with only redeliveries of skipped or failed messages count as empty
+            if new_messages:
+                empty_pulls = 0
+            else:
+                empty_pulls += 1
+
+    start_time = time.monotonic()
+    # One worker per allowed call, the engine's adaptive concurrency decides how many run at once
+    with ThreadPoolExecutor(max_workers=args.max_workers) as executor:
+        for future in [executor.submit(replay_worker) for _ in range(args.max_workers)]:
+            future.result()
+    elapsed = time.monotonic() - start_time
+
+    if held_ack_ids:
+        # Hand skipped and failed messages back to the dead-letter subscription right away instead of after the held deadline
+        ack_ids = list(held_ack_ids.values())
+        try:
+            for i in range(0, len(ack_ids), 1000):
+                engine.call_api(subscriber.modify_ack_deadline, request={
+                    "subscription": subscription_path,
+                    "ack_ids": ack_ids[i:i + 1000],
+                    "ack_deadline_seconds": 0,
+                })
+        except Exception as e:
+            print(f"Warning: could not release held messages, they return after {HELD_ACK_DEADLINE} seconds: {e}")
+
+    print(f"\n✓ Replayed {len(replayed_ids)} message(s) in {elapsed:.1f} seconds")
+    if skipped_ids:
+        print(f"Skipped {len(skipped_ids)} message(s) not matching the attribute filter (left in the dead-letter subscription)")
+    if failed_ids:
+        print(f"Failed to republish {len(failed_ids)} message(s) (left in the dead-letter subscription)")
+        exit(1)
+
 else:
     print(parser.format_help())
@@ -0,0 +1,101 @@
+"""Local HTTP stand-in for Google APIs that injects throttling and transient errors."""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from google.api_core import exceptions
+
+
+def error_body(status, reason=None):
+    """Build a Google API error payload, with a BigQuery-style `errors` reason if given."""
+    error = {"code": status, "message": f"injected {status}"}
+    if reason:
+        error["errors"] = [{"reason": reason, "message": f"injected {reason}"}]
+    return json.dumps({"error": error}).encode()
+
+
+class FaultServer:
+    """Serves scripted failures, then successes, and throttles when too many requests overlap.
+
+    `script` is a list of (status, reason) tuples answered in order before any
+    request succeeds. With `max_in_flight` set, requests beyond that many in
+    flight get a 429, and `latency` keeps each request open for a while so
+    overlapping requests can be observed. Successful requests are answered with
+    `success_body`, which real client libraries parse as the API resource.
+    """
+
+    def __init__(self, script=None, max_in_flight=None, latency=0.0, success_body=None):
+        self.script = list(script or [])
+        self.success_body = json.dumps(success_body or {"ok": True}).encode()
+        self.max_in_flight = max_in_flight
+        self.latency = latency
+        self.hits = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.lock = threading.Lock()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.respond()
+
+            def do_POST(self):
+                self.respond()
+
+            def do_DELETE(self):
+                self.respond()
+
+            def respond(self):
+                status, reason = server.next_response()
+                body = error_body(status, reason) if status >= 400 else server.success_body
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def next_response(self):
+        with self.lock:
+            self.hits += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            overloaded = self.max_in_flight is not None and self.in_flight > self.max_in_flight
+            scripted = self.script.pop(0) if self.script else None
+        try:
+            time.sleep(self.latency)
+            if scripted:
+                return scripted
+            if overloaded:
+                return 429, None
+            return 200, None
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def call(self, retry=None, timeout=5):
+        """Request the stand-in the way the HTTP-based Google clients do, raising API exceptions.
+
+        Accepts `retry` and `timeout` like a client method so it can be used with `Engine.call_api`.
+        """
+        response = requests.get(self.url, timeout=timeout)
+        if response.status_code >= 400:
+            raise exceptions.from_http_response(response)
+        return response.json()
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,148 @@
+import json
+import shutil
+import subprocess
+import time
+import uuid
+
+import pytest
+import requests
+
+import artifacts
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(artifacts, "cache_dir", tmp_path / "artifacts")
+    return tmp_path / "artifacts"
+
+
+def test_cache_returns_data_within_ttl(cache_dir):
+    artifacts.write_cache("images", [{"package": "app"}])
+
+    assert artifacts.read_cache("images", ttl=300) == [{"package": "app"}]
+    assert [path.name for path in cache_dir.iterdir()] == ["images.json"]
+
+
+def test_cache_expires_after_ttl(cache_dir):
+    artifacts.write_cache("images", ["app"])
+    entry = json.loads((cache_dir / "images.json").read_text())
+    entry["created_at"] -= 301
+    (cache_dir / "images.json").write_text(json.dumps(entry))
+
+    assert artifacts.read_cache("images", ttl=300) is None
+
+
+def test_cache_missing_entry_is_a_miss(cache_dir):
+    assert artifacts.read_cache("images", ttl=300) is None
+
+
+@pytest.mark.parametrize("content", ['{"created_at": 1', '["not", "an", "entry"]', '{"data": []}', '{"created_at": "now", "data": []}'])
+def test_corrupt_cache_is_a_miss(cache_dir, content):
+    cache_dir.mkdir(parents=True)
+    (cache_dir / "images.json").write_text(content)
+
+    assert artifacts.read_cache("images", ttl=300) is None
+
+
+def test_invalidate_cache(cache_dir):
+    artifacts.write_cache("images", [])
+    artifacts.invalidate_cache("images")
+    artifacts.invalidate_cache("images")
+
+    assert artifacts.read_cache("images", ttl=300) is None
+
+
+def write_manifest(tmp_path, manifest):
+    manifest_file = tmp_path / "manifest.json"
+    manifest_file.write_text(manifest if isinstance(manifest, str) else json.dumps(manifest))
+    return str(manifest_file)
+
+
+def test_load_manifest(tmp_path):
+    manifest = {"repository": "repo", "location": "us-central1", "images": [{"local": "app:1", "remote": "app:1"}]}
+
+    assert artifacts.load_manifest(write_manifest(tmp_path, manifest)) == manifest
+
+
+@pytest.mark.parametrize("manifest, error", [
+    ("{not json", "not valid JSON"),
+    (["app:1"], "must be an object"),
+    ({"images": "app:1"}, "must be an object"),
+    ({"images": ["app:1"]}, "image #1"),
+    ({"images": [{"local": "app:1", "remote": "app:1"}, {"local": "app:2"}]}, "image #2"),
+    ({"images": [{"local": "", "remote": "app:1"}]}, "image #1"),
+    ({"images": [{"local": "app:1", "remote": 1}]}, "image #1"),
+])
+def test_load_manifest_rejects_invalid_manifests(tmp_path, capsys, manifest, error):
+    with pytest.raises(SystemExit) as exit_info:
+        artifacts.load_manifest(write_manifest(tmp_path, manifest))
+
+    assert exit_info.value.code == 1
+    assert error in capsys.readouterr().out
+
+
+def test_load_manifest_missing_file(tmp_path, capsys):
+    with pytest.raises(SystemExit):
+        artifacts.load_manifest(str(tmp_path / "missing.json"))
+
+    assert "not found" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("image, repository", [
+    ("app", "app"),
+    ("app:v1", "app"),
+    ("localhost:5000/app", "localhost:5000/app"),
+    ("localhost:5000/app:v1", "localhost:5000/app"),
+    ("us-central1-docker.pkg.dev/project/repo/app:v1", "us-central1-docker.pkg.dev/project/repo/app"),
+    ("localhost:5000/app@sha256:abc", "localhost:5000/app"),
+    ("localhost:5000/app:v1@sha256:abc", "localhost:5000/app"),
+])
+def test_image_repository(image, repository):
+    assert artifacts.image_repository(image) == repository
+
+
+def docker(*args):
+    return subprocess.run(["docker", *args], capture_output=True, text=True)
+
+
+@pytest.fixture
+def registry():
+    """Run a throwaway registry:2 container, skipping when docker or the image is unavailable."""
+    if not shutil.which("docker") or docker("info").returncode != 0:
+        pytest.skip("docker is not available")
+    result = docker("run", "-d", "--rm", "-p", "127.0.0.1::5000", "registry:2")
+    if result.returncode != 0:
+        pytest.skip(f"could not start registry:2: {result.stderr.strip()}")
+    container = result.stdout.strip()
+
+    try:
+        port = docker("port", container, "5000").stdout.split(":")[-1].strip()
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                requests.get(f"http://127.0.0.1:{port}/v2/", timeout=1)
+                break
+            except requests.ConnectionError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.2)
+        yield f"localhost:{port}"
+    finally:
+        docker("rm", "-f", container)
+
+
+def test_push_then_skip_unchanged_image(registry, tmp_path):
+    (tmp_path / "payload").write_text(uuid.uuid4().hex)
+    (tmp_path / "Dockerfile").write_text("FROM scratch\nCOPY payload /payload\n")
+    local_image = f"gcptoolkit-test-app:{uuid.uuid4().hex[:12]}"
+    remote_image = f"{registry}/test-project/test-repo/app:v1"
+    build = docker("build", "-q", "-t", local_image, str(tmp_path))
+    if build.returncode != 0:
+        pytest.skip(f"could not build a test image: {build.stderr.strip()}")
+
+    try:
+        assert artifacts.tag_and_push(local_image, remote_image, force_push=False) == "pushed"
+        assert artifacts.tag_and_push(local_image, remote_image, force_push=False) == "skipped"
+        assert artifacts.tag_and_push(local_image, remote_image, force_push=True) == "pushed"
+    finally:
+        docker("rmi", "-f", local_image, remote_image)
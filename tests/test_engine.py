@@ -0,0 +1,277 @@
+import argparse
+import socket
+import time
+
+import pytest
+import requests
+from google.api_core import exceptions
+
+from _engine import AdaptiveConcurrency, Engine, TokenBucket, add_engine_arguments, engine_from_args
+from fault_server import FaultServer
+
+
+def fast_engine(**kwargs):
+    """Engine with millisecond backoff so retry tests run quickly."""
+    kwargs.setdefault("initial_backoff", 0.001)
+    kwargs.setdefault("max_backoff", 0.01)
+    return Engine("test", **kwargs)
+
+
+def test_retries_throttling_and_transient_errors_until_success():
+    with FaultServer(script=[(429, None), (503, None), (500, None)]) as server:
+        engine = fast_engine()
+
+        assert engine.call(server.call) == {"ok": True}
+
+    assert server.hits == 4
+    stats = engine.stats()
+    assert stats["calls"] == 1
+    assert stats["retries"] == 3
+    assert stats["throttles"] == 1
+    assert stats["failures"] == 0
+
+
+def test_retries_bigquery_rate_limit_reason_as_throttle():
+    with FaultServer(script=[(403, "rateLimitExceeded"), (400, "backendError")]) as server:
+        engine = fast_engine()
+
+        engine.call(server.call)
+
+    stats = engine.stats()
+    assert stats["retries"] == 2
+    assert stats["throttles"] == 1
+
+
+def test_does_not_retry_other_errors():
+    with FaultServer(script=[(403, "accessDenied"), (404, None)]) as server:
+        engine = fast_engine()
+
+        with pytest.raises(exceptions.Forbidden):
+            engine.call(server.call)
+
+    assert server.hits == 1
+    assert engine.stats()["failures"] == 1
+    assert engine.stats()["retries"] == 0
+
+
+def test_gives_up_after_max_retries():
+    with FaultServer(script=[(503, None)] * 10) as server:
+        engine = fast_engine(max_retries=2)
+
+        with pytest.raises(exceptions.ServiceUnavailable):
+            engine.call(server.call)
+
+    assert server.hits == 3
+    stats = engine.stats()
+    assert stats["retries"] == 2
+    assert stats["failures"] == 1
+    assert stats["calls"] == 0
+
+
+def test_gives_up_when_next_backoff_would_pass_deadline():
+    with FaultServer(script=[(503, None)] * 100) as server:
+        engine = Engine("test", max_retries=100, deadline=0.3, initial_backoff=0.05, max_backoff=0.1)
+
+        started_at = time.monotonic()
+        with pytest.raises(exceptions.ServiceUnavailable):
+            engine.call(server.call)
+        elapsed = time.monotonic() - started_at
+
+    assert elapsed < 0.3 + 0.2
+    assert 1 < server.hits < 100
+
+
+def test_retries_connection_errors_from_http_clients():
+    # Grab a free port with nothing listening on it
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        closed_url = f"http://127.0.0.1:{sock.getsockname()[1]}/"
+
+    with FaultServer() as server:
+        urls = [closed_url, server.url]
+        engine = fast_engine()
+
+        response = engine.call(lambda: requests.get(urls.pop(0), timeout=5))
+
+    assert response.status_code == 200
+    assert engine.stats()["retries"] == 1
+
+
+def test_call_api_turns_off_library_retries_and_passes_deadline():
+    seen = []
+    engine = fast_engine(deadline=30)
+
+    engine.call_api(lambda *args, **kwargs: seen.append((args, kwargs)), "bucket", force=True)
+
+    (args, kwargs), = seen
+    assert args == ("bucket",)
+    assert kwargs["force"] is True
+    assert kwargs["retry"] is None
+    assert 29 < kwargs["timeout"] <= 30
+
+
+def test_call_api_sees_throttles_from_storage_client():
+    storage = pytest.importorskip("google.cloud.storage")
+    from google.auth.credentials import AnonymousCredentials
+
+    with FaultServer(script=[(429, None), (503, None)], success_body={"name": "my-bucket"}) as server:
+        client = storage.Client(project="test", credentials=AnonymousCredentials(),
+                                client_options={"api_endpoint": server.url.rstrip("/")})
+        bucket = client.bucket("my-bucket")
+        engine = fast_engine()
+
+        engine.call_api(bucket.reload)
+
+    # Every attempt reached the engine, none were absorbed by the library's own retry
+    assert server.hits == 3
+    stats = engine.stats()
+    assert stats["throttles"] == 1
+    assert stats["retries"] == 2
+    assert stats["calls"] == 1
+
+
+def test_call_api_sees_rate_limits_from_bigquery_client():
+    bigquery = pytest.importorskip("google.cloud.bigquery")
+    from google.auth.credentials import AnonymousCredentials
+
+    dataset = {"datasetReference": {"projectId": "test", "datasetId": "my_dataset"}}
+    with FaultServer(script=[(403, "rateLimitExceeded")] * 2, success_body=dataset) as server:
+        client = bigquery.Client(project="test", credentials=AnonymousCredentials(),
+                                 client_options={"api_endpoint": server.url.rstrip("/")})
+        engine = fast_engine()
+
+        engine.call_api(client.create_dataset, "test.my_dataset")
+
+    assert server.hits == 3
+    assert engine.stats()["throttles"] == 2
+
+
+def test_adaptive_concurrency_halves_on_throttle_and_grows_back():
+    concurrency = AdaptiveConcurrency(initial=8, maximum=16)
+
+    first = concurrency.acquire()
+    second = concurrency.acquire()
+    concurrency.release(first, throttled=True)
+    assert int(concurrency.limit) == 4
+
+    # A throttle from a call started before the decrease saw the old limit and does not halve again
+    concurrency.release(second, throttled=True)
+    assert int(concurrency.limit) == 4
+
+    # Additive increase: roughly one limit's worth of successes adds one slot
+    for _ in range(5):
+        concurrency.release(concurrency.acquire())
+    assert int(concurrency.limit) == 5
+
+    for _ in range(200):
+        concurrency.release(concurrency.acquire())
+    assert concurrency.limit == 16
+
+
+def test_adaptive_concurrency_does_not_grow_on_errors():
+    concurrency = AdaptiveConcurrency(initial=4, maximum=16)
+
+    for _ in range(20):
+        concurrency.release(concurrency.acquire(), failed=True)
+
+    assert concurrency.limit == 4
+
+
+def test_engine_does_not_grow_concurrency_on_transient_errors():
+    with FaultServer(script=[(503, None)] * 40) as server:
+        engine = fast_engine(max_workers=16, initial_workers=4, max_retries=50)
+
+        list(engine.map(lambda _, **kwargs: server.call(**kwargs), range(4)))
+
+    # 40 failed attempts and 4 successes: only the successes may grow the limit
+    assert engine.stats()["retries"] == 40
+    assert engine.stats()["concurrency_limit"] == 4
+
+
+def test_adaptive_concurrency_never_drops_below_minimum():
+    concurrency = AdaptiveConcurrency(initial=2, maximum=16)
+
+    for _ in range(5):
+        concurrency.release(concurrency.acquire(), throttled=True)
+
+    assert concurrency.limit == 1
+
+
+def test_engine_backs_off_concurrency_against_throttling_server():
+    with FaultServer(max_in_flight=4, latency=0.02) as server:
+        engine = fast_engine(max_workers=32, initial_workers=16)
+
+        results = list(engine.map(lambda _, **kwargs: server.call(**kwargs), range(200)))
+
+    assert all(error is None for _, _, error in results)
+    stats = engine.stats()
+    assert stats["calls"] == 200
+    assert stats["throttles"] > 0
+    assert stats["retries"] == stats["throttles"]
+    assert stats["concurrency_limit"] < 16
+
+
+def test_engine_grows_concurrency_without_throttling():
+    with FaultServer(latency=0.005) as server:
+        engine = fast_engine(max_workers=16, initial_workers=2)
+
+        list(engine.map(lambda _, **kwargs: server.call(**kwargs), range(200)))
+
+    assert engine.stats()["concurrency_limit"] > 2
+    assert server.peak_in_flight > 2
+
+
+def test_token_bucket_holds_rate():
+    bucket = TokenBucket(rate=50, capacity=1)
+
+    started_at = time.monotonic()
+    for _ in range(26):
+        bucket.acquire()
+    elapsed = time.monotonic() - started_at
+
+    # The first token is available immediately, the other 25 take 0.5 seconds
+    assert 0.45 <= elapsed < 0.75
+
+
+def test_token_bucket_rejects_requests_larger_than_capacity():
+    with pytest.raises(ValueError):
+        TokenBucket(rate=5).acquire(10)
+
+
+def test_engine_qps_limit_and_stats():
+    with FaultServer() as server:
+        engine = fast_engine(qps=40)
+
+        for _ in range(80):
+            engine.call(server.call)
+
+    stats = engine.stats()
+    assert stats["calls"] == 80
+    assert stats["retries"] == stats["throttles"] == stats["failures"] == 0
+    # 40 burst tokens are spent at once, the other 40 calls take a second
+    assert stats["effective_qps"] <= 40 * 2 + 5
+
+
+def parse_engine_args(*argv):
+    parser = argparse.ArgumentParser()
+    add_engine_arguments(parser)
+    return parser.parse_args(argv)
+
+
+@pytest.mark.parametrize("argv", [
+    ("--max-retries", "-1"),
+    ("--deadline", "0"),
+    ("--max-workers", "0"),
+    ("--max-qps", "-5"),
+])
+def test_engine_from_args_rejects_invalid_options(argv):
+    with pytest.raises(SystemExit):
+        engine_from_args("test", parse_engine_args(*argv))
+
+
+def test_engine_from_args_uses_options():
+    engine = engine_from_args("test", parse_engine_args("--max-qps", "10", "--max-retries", "2", "--max-workers", "8"))
+
+    assert engine.bucket.rate == 10
+    assert engine.max_retries == 2
+    assert engine.concurrency.maximum == 8